@@ -2,12 +2,108 @@
 from typing import List, Dict, Any
 import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 import chromadb
+import torch
 from sentence_transformers import SentenceTransformer
 
 # Use a single model for BOTH indexing and querying
-_model = SentenceTransformer("all-MiniLM-L6-v2")
+_MODEL_NAME = "all-MiniLM-L6-v2"
+_model = SentenceTransformer(_MODEL_NAME)
+
+# Encoding dominates ingest time. Big batches amortize per-call transformer
+# dispatch overhead; FP16 on GPU halves activation bandwidth.
+EMB_BATCH = int(os.getenv("EMB_BATCH", "128"))
+
+# Rows per coll.add() call. One huge add makes chroma build an oversized
+# HTTP payload and stalls the HNSW insert; ~256 keeps both sides smooth.
+ADD_BATCH = int(os.getenv("ADD_BATCH", "256"))
+
+# Single worker that ships add() calls to chroma while the CPU/GPU encodes
+# the next slice. One thread keeps inserts ordered per collection; adds are
+# network-bound so this overlaps cleanly with encoding.
+_add_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chroma-add")
+
+if torch.cuda.is_available():
+    _model = _model.to("cuda").half()
+else:
+    # CPU fallback: let torch use every core for the forward pass
+    torch.set_num_threads(os.cpu_count() or 1)
+
+# Optional ONNX backend (roughly 4x on CPU). Export once with:
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 <dir>
+# then point EMB_ONNX_MODEL at <dir>. Falls back to the torch model if the
+# export (or optimum itself) is missing, so the container still boots.
+EMB_ONNX_MODEL = os.getenv("EMB_ONNX_MODEL", "")
+
+_onnx_encoder = None
+if EMB_ONNX_MODEL:
+    try:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        _onnx_encoder = (
+            ORTModelForFeatureExtraction.from_pretrained(EMB_ONNX_MODEL),
+            AutoTokenizer.from_pretrained(EMB_ONNX_MODEL),
+        )
+    except Exception as e:
+        print(f"[EMBEDDER] ONNX model unavailable ({e}); using {_MODEL_NAME} instead")
+
+
+def _encode_onnx(texts: List[str]):
+    import numpy as np
+
+    ort_model, tokenizer = _onnx_encoder
+
+    # Batch similar-length texts together so short lines don't get padded to
+    # the longest line in the whole corpus (sentence-transformers does this
+    # internally; here we have to do it ourselves).
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+    parts = []
+    for start in range(0, len(order), EMB_BATCH):
+        enc = tokenizer(
+            [texts[i] for i in order[start : start + EMB_BATCH]],
+            padding=True,
+            truncation=True,
+            max_length=256,
+            return_tensors="np",
+        )
+        hidden = ort_model(**enc).last_hidden_state
+        # Mean pooling over real tokens (same as the sentence-transformers head)
+        mask = enc["attention_mask"][:, :, None]
+        parts.append((hidden * mask).sum(axis=1) / mask.sum(axis=1).clip(min=1))
+
+    emb = np.concatenate(parts)
+    emb /= np.linalg.norm(emb, axis=1, keepdims=True).clip(min=1e-12)
+
+    # Undo the length sort so vectors line up with the caller's texts
+    out = np.empty_like(emb)
+    out[order] = emb
+    return out.astype(np.float32)
+
+
+def _encode(texts: List[str]):
+    """Encode to L2-normalized float32 vectors (numpy) on whichever backend
+    is active.
+
+    float32 is a contract: chroma 0.5.3's HNSW stores float32 only (no
+    int8/SQ option), and the FP16 GPU path would otherwise hand back
+    float16 arrays. Quantization happens at encode time (half precision on
+    GPU), not at rest.
+    """
+    if _onnx_encoder is not None:
+        return _encode_onnx(texts)
+    emb = _model.encode(
+        texts,
+        batch_size=EMB_BATCH,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+    return emb.astype("float32", copy=False)
 
 CHROMA_HOST = os.getenv("CHROMA_HOST", "chroma")  # docker-compose service name
 CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
@@ -16,6 +112,15 @@ CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
 # Start stricter for demos (0.55–0.65). Loosen only if too many empty results.
 SEARCH_MAX_DISTANCE = float(os.getenv("SEARCH_MAX_DISTANCE", "0.70"))
 
+# HNSW build knobs, applied when a collection is first created (chroma
+# ignores them on later get_or_create calls). Higher M/construction_ef =
+# better recall but slower inserts; hnsw:batch_size controls how many
+# vectors chroma buffers before an index build pass. Size these for your
+# typical case, not per request — a collection can't be retuned later.
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "128"))
+HNSW_BATCH_SIZE = int(os.getenv("HNSW_BATCH_SIZE", "256"))
+
 
 def _make_client():
     """
@@ -29,10 +134,19 @@ def _make_client():
 _client = _make_client()
 
 
+@lru_cache(maxsize=128)
 def _get_collection(case_id: str):
+    # get_or_create_collection is an HTTP round-trip to the chroma service;
+    # every embed batch and every /search call was paying it. Collection
+    # handles are just name+id wrappers, so caching per case is safe.
     return _client.get_or_create_collection(
         name=f"case_{case_id}",
-        metadata={"hnsw:space": "cosine"},
+        metadata={
+            "hnsw:space": "cosine",
+            "hnsw:M": HNSW_M,
+            "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+            "hnsw:batch_size": HNSW_BATCH_SIZE,
+        },
     )
 
 
@@ -44,18 +158,41 @@ def embed_texts(case_id: str, texts: List[str], metadata_list: List[Dict[str, An
 
     coll = _get_collection(case_id)
 
-    # Normalize vectors so cosine distances behave correctly
-    embeddings = _model.encode(texts, normalize_embeddings=True).tolist()
-
     # Unique IDs avoid collisions across multiple ingests/reindexes
     ids = [f"{case_id}_{uuid.uuid4().hex}" for _ in texts]
 
-    coll.add(
-        ids=ids,
-        documents=texts,
-        metadatas=metadata_list,
-        embeddings=embeddings,
-    )
+    # Encode slice N+1 while slice N is in flight to chroma. Vectors stay
+    # L2-normalized so cosine distances behave. (The HttpClient still
+    # .tolist()s ndarrays before JSON-serializing — the win here is the
+    # encode/add overlap and skipping our own extra conversion, not
+    # avoiding lists entirely.) result() on the previous future keeps
+    # errors loud and memory bounded.
+    pending = None
+    for start in range(0, len(texts), ADD_BATCH):
+        end = start + ADD_BATCH
+        embeddings = _encode(texts[start:end])
+        if pending is not None:
+            pending.result()
+        pending = _add_pool.submit(
+            coll.add,
+            ids=ids[start:end],
+            documents=texts[start:end],
+            metadatas=metadata_list[start:end],
+            embeddings=embeddings,
+        )
+    if pending is not None:
+        pending.result()
+
+
+@lru_cache(maxsize=256)
+def _encode_query(query: str):
+    """
+    Memoized single-query encode. The UI re-sends identical queries
+    (metadata toggle, re-opened tabs), and a full transformer forward pass
+    per repeat is the slowest part of /search. Tokenizer state itself is
+    already cached inside the SentenceTransformer instance.
+    """
+    return _encode([query])[0]
 
 
 def semantic_search(case_id: str, query: str, top_k: int = 5) -> Dict[str, Any]:
@@ -69,39 +206,32 @@ def semantic_search(case_id: str, query: str, top_k: int = 5) -> Dict[str, Any]:
 
     coll = _get_collection(case_id)
 
-    q_emb = _model.encode([query], normalize_embeddings=True)[0].tolist()
+    q_emb = _encode_query(query)
 
     # IMPORTANT (Chroma 0.5.3):
     # include cannot contain "ids" — ids come back automatically.
+    # 2-D ndarray, not [ndarray]: chroma 0.5.3 only .tolist()s a top-level
+    # array — a Python list holding an ndarray fails its embedding
+    # validation and would 500 every search.
     res = coll.query(
-        query_embeddings=[q_emb],
+        query_embeddings=q_emb.reshape(1, -1),
         n_results=top_k,
         include=["documents", "metadatas", "distances"],
     )
 
-    hits = []
     ids0 = (res.get("ids") or [[]])[0]
     dists0 = (res.get("distances") or [[]])[0]
     docs0 = (res.get("documents") or [[]])[0]
     metas0 = (res.get("metadatas") or [[]])[0]
 
-    for i in range(min(len(ids0), len(dists0), len(docs0), len(metas0))):
-        dist = dists0[i]
-        if dist is None:
-            continue
-
-        # KEY: filter garbage matches.
-        # Without this, random queries will still return "nearest neighbors".
-        if dist > SEARCH_MAX_DISTANCE:
-            continue
-
-        hits.append(
-            {
-                "id": ids0[i],
-                "distance": dist,
-                "text": docs0[i],
-                "metadata": metas0[i],
-            }
-        )
+    # zip stops at the shortest column (same truncation the old index loop
+    # did) and keeps the materialization in a single C-level pass.
+    # KEY: the distance filter drops garbage matches — without it, random
+    # queries still return "nearest neighbors".
+    hits = [
+        {"id": hit_id, "distance": dist, "text": doc, "metadata": meta}
+        for hit_id, dist, doc, meta in zip(ids0, dists0, docs0, metas0)
+        if dist is not None and dist <= SEARCH_MAX_DISTANCE
+    ]
 
     return {"results": hits}
@@ -1,6 +1,8 @@
 # api/ingest_utils.py
 import os
-from typing import List, Dict, Any
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple
 
 from api.evtx_parser import generate_evtx_derivatives
 from api.registry_parser import generate_registry_derivatives
@@ -12,6 +14,8 @@ REGISTRY_EXTENSIONS = {".dat", ".hiv", ".hive", ".reg"}
 MAX_FILE_CHARS = int(os.getenv("MAX_FILE_CHARS", "20000"))       # safety for huge files
 CHUNK_CHARS = int(os.getenv("CHUNK_CHARS", "1200"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))
+EMBED_FLUSH_LINES = int(os.getenv("EMBED_FLUSH_LINES", "2000"))  # embed+index per batch, not per corpus
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
 
 
 def _chunk_text(text: str, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
@@ -30,6 +34,64 @@ def _chunk_text(text: str, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OV
     return out
 
 
+def _iter_case_files(root_dir: str):
+    """
+    Recursively yield (path, filename) under root_dir.
+
+    os.scandir hands back the name and type from the directory read itself,
+    so unlike os.walk + per-file path juggling there's no extra stat() per
+    entry on big evidence trees.
+    """
+    stack = [root_dir]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.name
+        except OSError:
+            continue
+
+
+def _iter_summary_line_blocks(path: str, block_chars: int = 1 << 20):
+    """
+    Yield batches (lists) of non-empty stripped lines from a derivative
+    .txt file.
+
+    Reads ~1MB blocks and hands back whole batches so callers can use
+    extend/join instead of per-line appends — these files can run to
+    hundreds of thousands of one-line summaries, and keeping the inner
+    loop in C-level list/str operations is most of the win a native
+    extension would buy here.
+    """
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        tail = ""
+        while True:
+            block = f.read(block_chars)
+            if not block:
+                break
+            lines = (tail + block).split("\n")
+            tail = lines.pop()
+            stripped = [s for line in lines if (s := line.strip())]
+            if stripped:
+                yield stripped
+        tail = tail.strip()
+        if tail:
+            yield [tail]
+
+
+def _generate_derivatives(job: Tuple[str, str, str]) -> Dict[str, Any]:
+    """Worker entry for derivative generation (must stay module-level so
+    ProcessPoolExecutor can pickle it)."""
+    kind, path, case_dir = job
+    if kind == "evtx":
+        return generate_evtx_derivatives(path, case_dir)
+    return generate_registry_derivatives(path, case_dir)
+
+
 def _read_text_file(path: str) -> str:
     try:
         with open(path, "r", encoding="utf-8", errors="ignore") as f:
@@ -46,8 +108,21 @@ def build_and_index_case_corpus(case_dir: str, case_id: str) -> int:
 
     Returns number of text chunks indexed.
     """
+    # Rolling buffers, flushed every EMBED_FLUSH_LINES so a big case never
+    # holds its whole corpus (texts + metadata) in memory at once.
     text_chunks: List[str] = []
     metadata_list: List[Dict[str, Any]] = []
+    total_indexed = 0
+
+    def _flush() -> None:
+        nonlocal total_indexed
+        if not text_chunks:
+            return
+        print(f"[EMBED] case={case_id} batch={total_indexed}-{total_indexed + len(text_chunks) - 1}")
+        embed_texts(case_id, text_chunks, metadata_list)
+        total_indexed += len(text_chunks)
+        text_chunks.clear()
+        metadata_list.clear()
 
     # Prefer scanning extracted evidence in /files only (prevents feedback loops)
     scan_root = os.path.join(case_dir, "files")
@@ -57,88 +132,93 @@ def build_and_index_case_corpus(case_dir: str, case_id: str) -> int:
     evtx_summary_path = os.path.join(case_dir, "evtx_summaries.jsonl")
     reg_summary_path = os.path.join(case_dir, "registry_summaries.jsonl")
 
+    # Pass 1: classify files. EVTX/registry parsing is CPU-bound (XML, hive
+    # walking), so those become parse jobs; text files are cheap and are
+    # chunked inline later.
+    parse_jobs: List[Tuple[str, str, str, str]] = []   # (kind, path, rel_path, filename)
+    text_files: List[Tuple[str, str]] = []             # (path, rel_path)
+
+    for path, filename in _iter_case_files(scan_root):
+        # Skip our own outputs if scanning case_dir directly
+        if filename in ("evtx_summaries.jsonl", "registry_summaries.jsonl", "metadata.jsonl"):
+            continue
+
+        dot = filename.rfind(".")
+        ext = filename[dot:].lower() if dot > 0 else ""
+        rel_path = os.path.relpath(path, case_dir)
+
+        if ext == ".evtx":
+            parse_jobs.append(("evtx", path, rel_path, filename))
+        elif ext in REGISTRY_EXTENSIONS:
+            print(f"[REGISTRY] candidate: {filename}")
+            parse_jobs.append(("registry", path, rel_path, filename))
+        elif ext in TEXT_EXTENSIONS:
+            text_files.append((path, rel_path))
+
+    # Pass 2: generate derivatives, across processes when there's more than
+    # one file to parse. Each job writes its own artifacts/<kind>/<base>.*
+    # pair, so workers never touch the same output file.
+    jobs = [(kind, path, case_dir) for kind, path, _, _ in parse_jobs]
+    if len(jobs) > 1 and INGEST_WORKERS > 1:
+        # fork explicitly: under spawn each worker would re-import this
+        # module and drag the sentence-transformer model up with it
+        with ProcessPoolExecutor(
+            max_workers=min(INGEST_WORKERS, len(jobs)),
+            mp_context=multiprocessing.get_context("fork"),
+        ) as pool:
+            stats_list = list(pool.map(_generate_derivatives, jobs))
+    else:
+        stats_list = [_generate_derivatives(job) for job in jobs]
+
+    # Pass 3: index the derivative summaries (order follows the scan, so
+    # output stays deterministic regardless of worker scheduling).
     with open(evtx_summary_path, "w", encoding="utf-8") as evtx_summary_f, \
          open(reg_summary_path, "w", encoding="utf-8") as reg_summary_f:
 
-        for root, _, files in os.walk(scan_root):
-            for filename in files:
-                path = os.path.join(root, filename)
-                ext = os.path.splitext(filename)[1].lower()
-                rel_path = os.path.relpath(path, case_dir)
-
-                # Skip our own outputs if scanning case_dir directly
-                if filename in ("evtx_summaries.jsonl", "registry_summaries.jsonl", "metadata.jsonl"):
+        for (kind, path, rel_path, filename), stats in zip(parse_jobs, stats_list):
+            if kind == "evtx":
+                print(f"[EVTX] {filename}: {stats['events_count']} events parsed")
+                summary_f = evtx_summary_f
+            else:
+                print(f"[REGISTRY] {filename}: {stats['events_count']} entries parsed")
+                if stats.get("events_count", 0) <= 0:
                     continue
-
-                # 1) EVTX
-                if ext == ".evtx":
-                    stats = generate_evtx_derivatives(path, case_dir)
-                    print(f"[EVTX] {filename}: {stats['events_count']} events parsed")
-
-                    # Index the one-line summaries generated by evtx_parser
-                    try:
-                        with open(stats["txt_path"], "r", encoding="utf-8", errors="ignore") as f:
-                            for line in f:
-                                line = line.strip()
-                                if not line:
-                                    continue
-                                text_chunks.append(line)
-                                metadata_list.append({
-                                    "source": "evtx",
-                                    "case_id": case_id,
-                                    "file": rel_path,
-                                })
-                                evtx_summary_f.write(line + "\n")
-                    except Exception as e:
-                        print(f"[EVTX] failed reading derivative txt for {filename}: {e}")
-
-                # 2) Registry
-                elif ext in REGISTRY_EXTENSIONS:
-                    print(f"[REGISTRY] candidate: {filename}")
-                    stats = generate_registry_derivatives(path, case_dir)
-                    print(f"[REGISTRY] {filename}: {stats['events_count']} entries parsed")
-
-                    if stats.get("events_count", 0) > 0:
-                        try:
-                            with open(stats["txt_path"], "r", encoding="utf-8", errors="ignore") as f:
-                                for line in f:
-                                    line = line.strip()
-                                    if not line:
-                                        continue
-                                    text_chunks.append(line)
-                                    metadata_list.append({
-                                        "source": "registry",
-                                        "case_id": case_id,
-                                        "file": rel_path,
-                                    })
-                                    reg_summary_f.write(line + "\n")
-                        except Exception as e:
-                            print(f"[REGISTRY] failed reading derivative txt for {filename}: {e}")
-
-                # 3) Normal text-like files
-                elif ext in TEXT_EXTENSIONS:
-                    content = _read_text_file(path)
-                    if not content.strip():
-                        continue
-
-                    # Chunk so embeddings don’t become garbage
-                    chunks = _chunk_text(content)
-                    for idx, ch in enumerate(chunks):
-                        text_chunks.append(ch)
-                        metadata_list.append({
-                            "source": "file",
-                            "case_id": case_id,
-                            "file": rel_path,
-                            "chunk": idx,
-                        })
-
-    # Embed in safe batches
-    if text_chunks:
-        max_batch = 2000
-        total = len(text_chunks)
-        for start in range(0, total, max_batch):
-            end = min(start + max_batch, total)
-            print(f"[EMBED] case={case_id} batch={start}-{end-1} of {total}")
-            embed_texts(case_id, text_chunks[start:end], metadata_list[start:end])
-
-    return len(text_chunks)
+                summary_f = reg_summary_f
+
+            # Every line in the file shares the same metadata, so reuse one
+            # dict by reference instead of allocating one per line (chroma
+            # serializes per row; the dict is never mutated).
+            meta = {"source": kind, "case_id": case_id, "file": rel_path}
+            try:
+                for lines in _iter_summary_line_blocks(stats["txt_path"]):
+                    text_chunks.extend(lines)
+                    metadata_list.extend([meta] * len(lines))
+                    summary_f.write("\n".join(lines) + "\n")
+                    if len(text_chunks) >= EMBED_FLUSH_LINES:
+                        _flush()
+            except Exception as e:
+                print(f"[{kind.upper()}] failed reading derivative txt for {filename}: {e}")
+
+        # Normal text-like files
+        for path, rel_path in text_files:
+            content = _read_text_file(path)
+            if not content.strip():
+                continue
+
+            # Chunk so embeddings don’t become garbage
+            chunks = _chunk_text(content)
+            for idx, ch in enumerate(chunks):
+                text_chunks.append(ch)
+                metadata_list.append({
+                    "source": "file",
+                    "case_id": case_id,
+                    "file": rel_path,
+                    "chunk": idx,
+                })
+                if len(text_chunks) >= EMBED_FLUSH_LINES:
+                    _flush()
+
+    # Embed whatever is left in the buffers
+    _flush()
+
+    return total_indexed
@@ -2,14 +2,14 @@ import os
 import sys
 import json
 import uuid
-import shutil
 import hashlib
 import subprocess
 from pathlib import Path
 from typing import Any, Dict, Optional, List
 
+import orjson
 from fastapi import FastAPI, UploadFile, BackgroundTasks, Body, Query
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -34,7 +34,9 @@ os.makedirs(ARTIFACT_DIR, exist_ok=True)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
-app = FastAPI(title="Pre-Investigation DFIR Agent")
+# orjson serializes big payloads (timelines, summary lines) several times
+# faster than the stdlib encoder behind the default JSONResponse
+app = FastAPI(title="Pre-Investigation DFIR Agent", default_response_class=ORJSONResponse)
 
 # Static UI
 static_dir = os.path.join(os.path.dirname(__file__), "..", "static")
@@ -79,25 +81,24 @@ def read_limited_lines(path: Path, max_lines: int = DETAIL_LINES_LIMIT, max_char
     return lines[:max_lines]
 
 
-def save_upload(file: UploadFile, target_path: str) -> None:
+def save_upload(file: UploadFile, target_path: str) -> str:
+    """Write the upload to disk and return its SHA-256 (hashed while copying,
+    so big images aren't read back from disk a second time)."""
     os.makedirs(os.path.dirname(target_path), exist_ok=True)
     try:
         file.file.seek(0)
     except Exception:
         pass
 
+    h = hashlib.sha256()
     with open(target_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+        while chunk := file.file.read(1024 * 1024):
+            h.update(chunk)
+            f.write(chunk)
 
     if os.path.getsize(target_path) == 0:
         raise RuntimeError(f"Saved upload is 0 bytes: {target_path}")
 
-
-def hash_file(path: str) -> str:
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
     return h.hexdigest()
 
 
@@ -140,16 +141,15 @@ async def ingest_image(file: UploadFile, background_tasks: BackgroundTasks):
     safe_name = os.path.basename(file.filename)
     image_path = os.path.join(dest_dir, safe_name)
 
-    save_upload(file, image_path)
+    sha = save_upload(file, image_path)
 
     if (not os.path.exists(image_path)) or (os.path.getsize(image_path) == 0):
         return JSONResponse(status_code=500, content={"error": "Upload save failed", "path": image_path})
 
-    sha = hash_file(image_path)
     ingest_meta = {"case_id": case_id, "filename": safe_name, "sha256": sha}
 
-    with open(os.path.join(dest_dir, "ingest.json"), "w", encoding="utf-8") as f:
-        json.dump(ingest_meta, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(dest_dir, "ingest.json"), "wb") as f:
+        f.write(orjson.dumps(ingest_meta, option=orjson.OPT_INDENT_2))
 
     # Run extraction async
     background_tasks.add_task(kick_extract_task, image_path, case_id)
@@ -180,8 +180,8 @@ def ingest_text(body: Dict[str, Any] = Body(...)):
         "metadata": metadata,
     }
 
-    with open(os.path.join(dest_dir, "ingest.json"), "w", encoding="utf-8") as f:
-        json.dump(ingest_meta, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(dest_dir, "ingest.json"), "wb") as f:
+        f.write(orjson.dumps(ingest_meta, option=orjson.OPT_INDENT_2))
 
     try:
         embed_texts(case_id, [text], [metadata])